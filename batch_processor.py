@@ -1,15 +1,46 @@
 import os
-import json
 import argparse
-import glob
-from typing import List, Dict, Any
+import logging
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Any, Tuple
 from dotenv import load_dotenv
-from bom_analyzer import BOMAnalyzer, generate_sample_orders
+from tqdm import tqdm
+from bom_analyzer import BOMAnalyzer, dumps_json, generate_sample_orders, loads_json
 
 # Load environment variables from .env file
 load_dotenv()
 
-def process_batch(
+# Location of the persistent model response cache
+CACHE_PATH = "./.bom_cache"
+
+def load_order_file(filename: str) -> Dict[str, Any]:
+    """Load order data from a JSON file."""
+    with open(filename, 'rb') as f:
+        return loads_json(f.read())
+
+def positive_int(value: str) -> int:
+    """Parse a command line argument that must be a positive integer."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def write_json_file(data: Dict[str, Any], filename: str) -> None:
+    """
+    Write data to a JSON file atomically.
+    
+    The data is written to a temporary file which then replaces the target,
+    so an interrupted run never leaves a partially written file behind.
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'wb') as f:
+        f.write(dumps_json(data, indent=True))
+    os.replace(tmp_filename, filename)
+
+async def process_batch(
     input_dir: str, 
     output_dir: str, 
     csv_report: str = None,
@@ -19,7 +50,13 @@ def process_batch(
     azure_deployment: str = None,
     azure_api_version: str = '2024-02-01',
     reference_file: str = None,
-    skip_local_validation: bool = False
+    skip_local_validation: bool = False,
+    max_concurrency: int = 16,
+    use_cache: bool = True,
+    batch_size: int = 8,
+    max_retries: int = 5,
+    force: bool = False,
+    always_llm: bool = False
 ) -> None:
     """
     Process all JSON files in the input directory and save analysis results to the output directory.
@@ -33,7 +70,21 @@ def process_batch(
         azure_endpoint: Azure OpenAI endpoint URL
         azure_deployment: Azure OpenAI deployment name
         azure_api_version: Azure OpenAI API version
+        reference_file: Path to reference data CSV file for item validation
+        skip_local_validation: Skip local item validation (use only AI analysis)
+        max_concurrency: Maximum number of API requests in flight at once
+        use_cache: Reuse cached model responses for previously analyzed orders
+        batch_size: Maximum number of orders packed into a single API request
+        max_retries: Retries for rate-limited, timed-out or failed API requests
+        force: Reanalyze files that already have results in the output directory
+        always_llm: Run AI analysis even for orders that pass local validation
     """
+    # A semaphore with no slots would never let a request through
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
     
@@ -72,6 +123,8 @@ def process_batch(
                 print("No API key provided. Exiting.")
                 return
     
+    cache_path = CACHE_PATH if use_cache else None
+    
     # Initialize the analyzer with appropriate provider and settings
     if provider == 'azure':
         analyzer = BOMAnalyzer(
@@ -81,61 +134,198 @@ def process_batch(
             azure_endpoint=azure_endpoint,
             azure_deployment=azure_deployment,
             azure_api_version=azure_api_version,
-            reference_file=reference_file
+            reference_file=reference_file,
+            cache_path=cache_path,
+            max_retries=max_retries,
+            always_llm=always_llm
         )
     else:
         analyzer = BOMAnalyzer(
             api_key=api_key, 
             model=model,
-            reference_file=reference_file
+            reference_file=reference_file,
+            cache_path=cache_path,
+            max_retries=max_retries,
+            always_llm=always_llm
         )
     
-    # Find all JSON files in the input directory
-    json_files = glob.glob(os.path.join(input_dir, "*.json"))
-    if not json_files:
-        print(f"No JSON files found in {input_dir}")
-        return
-    
-    print(f"Found {len(json_files)} JSON files to process")
-    
-    # Process each file
-    for i, json_file in enumerate(json_files, 1):
-        file_name = os.path.basename(json_file)
-        print(f"\n[{i}/{len(json_files)}] Processing {file_name}...")
+    try:
+        # Find all JSON files in the input directory
+        json_files = [
+            entry for entry in os.scandir(input_dir)
+            if entry.name.endswith(".json") and entry.is_file()
+        ]
+        if not json_files:
+            print(f"No JSON files found in {input_dir}")
+            return
         
-        try:
-            # Load order data
-            with open(json_file, 'r') as f:
-                order_data = json.load(f)
+        print(f"Found {len(json_files)} JSON files to process")
+        
+        # Skip files analyzed by a previous run unless forced; failed analyses are saved
+        # under another name, so they are retried
+        skipped = []
+        if not force:
+            analyzed = {entry.name for entry in os.scandir(output_dir)}
+            skipped = [entry for entry in json_files if f"analysis_{entry.name}" in analyzed]
+            remaining = [entry for entry in json_files if f"analysis_{entry.name}" not in analyzed]
+            if skipped:
+                print(f"Skipping {len(skipped)} already analyzed files (use --force to reanalyze)")
+            json_files = remaining
+            if not json_files and not csv_report:
+                print("Nothing left to process")
+                return
+        
+        async def load_entry(json_file: os.DirEntry) -> Tuple[str, Any]:
+            try:
+                order_data = await asyncio.to_thread(load_order_file, json_file.path)
+                if not isinstance(order_data, dict):
+                    raise ValueError("order file must contain a JSON object")
+                return json_file.name, order_data
+            except Exception as e:
+                return json_file.name, e
+        
+        def load_previous_results(json_file: os.DirEntry) -> Tuple[str, Dict[str, Any]]:
+            """Return the order ID and saved analysis results of a skipped file."""
+            order_data = load_order_file(json_file.path)
+            order_id = os.path.splitext(json_file.name)[0]
+            if isinstance(order_data, dict):
+                order_id = order_data.get("order_id", order_id)
+            return order_id, load_order_file(os.path.join(output_dir, f"analysis_{json_file.name}"))
+        
+        async def report_previous(json_file: os.DirEntry) -> None:
+            try:
+                reporter.append(*await asyncio.to_thread(load_previous_results, json_file))
+            except Exception as e:
+                tqdm.write(f"Error reporting {json_file.name}: {str(e)}")
+        
+        # Limit in-flight API calls to respect rate limits; the analyzer holds it for every request
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        def report_error(file_name: str, error: Exception) -> None:
+            # tqdm.write keeps the progress bar intact
+            tqdm.write(f"Error processing {file_name}: {str(error)}")
+            totals["errors"] += 1
+            pbar.update(1)
+            pbar.set_postfix(totals)
+        
+        async def process_chunk(chunk: List[Tuple[str, Dict[str, Any]]]) -> None:
+            try:
+                # Analyze the orders
+                chunk_results = await analyzer.analyze_orders_batch_async(
+                    [order_data for _, order_data in chunk],
+                    batch_size=batch_size,
+                    use_local_validation=not skip_local_validation,
+                    semaphore=semaphore
+                )
+            except Exception as e:
+                for file_name, _ in chunk:
+                    report_error(file_name, e)
+                return
             
-            # Analyze the order
-            analysis_results = analyzer.analyze_order(
-                order_data, 
-                use_local_validation=not skip_local_validation
-            )
+            for (file_name, order_data), analysis_results in zip(chunk, chunk_results):
+                try:
+                    # Results of a failed API call are saved under another name, so a
+                    # resumed run retries the order
+                    if "api_error" in analysis_results:
+                        output_file = os.path.join(output_dir, f"failed_analysis_{file_name}")
+                        await asyncio.to_thread(write_json_file, analysis_results, output_file)
+                        report_error(file_name, RuntimeError(analysis_results["api_error"]))
+                        continue
+                    
+                    # Save analysis results to output directory
+                    output_file = os.path.join(output_dir, f"analysis_{file_name}")
+                    await asyncio.to_thread(write_json_file, analysis_results, output_file)
+                    
+                    # Drop the results of an earlier failed attempt
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(output_dir, f"failed_analysis_{file_name}"))
+                    
+                    # Add to CSV report if requested
+                    if reporter:
+                        order_id = order_data.get("order_id", os.path.splitext(file_name)[0])
+                        reporter.append(order_id, analysis_results)
+                    
+                    # Update progress summary
+                    if analysis_results.get("issues_found", False):
+                        totals["issues"] += analysis_results.get("total_issues", 0)
+                    pbar.update(1)
+                    pbar.set_postfix(totals)
+                    
+                except Exception as e:
+                    report_error(file_name, e)
             
-            # Save analysis results to output directory
-            output_file = os.path.join(output_dir, f"analysis_{file_name}")
-            with open(output_file, 'w') as f:
-                json.dump(analysis_results, f, indent=2)
+            # Write the chunk's report rows now, so a killed run does not lose rows for
+            # orders whose JSON results are already on disk and will be skipped on resume
+            if reporter:
+                reporter.flush()
+        
+        # Start loading every order so disk reads overlap with the API calls
+        load_tasks = [asyncio.create_task(load_entry(json_file)) for json_file in json_files]
+        
+        totals = {"issues": 0, "errors": 0}
+        
+        # Keep the CSV report open for the whole batch
+        with tqdm(total=len(json_files), desc="BOM batch", unit="order") as pbar, \
+                analyzer.open_csv_sink(csv_report) if csv_report else contextlib.nullcontext() as reporter:
+            # Files skipped as already analyzed are reported from their saved results
+            if reporter and skipped:
+                await asyncio.gather(*(report_previous(json_file) for json_file in skipped))
+                reporter.flush()
             
-            # Add to CSV report if requested
-            if csv_report:
-                order_id = order_data.get("order_id", os.path.splitext(file_name)[0])
-                analyzer.save_analysis_to_csv(order_id, analysis_results, csv_report)
+            # Several orders are packed into each API request; a chunk is
+            # dispatched as soon as enough orders have loaded
+            tasks = []
+            chunk = []
+            for next_entry in asyncio.as_completed(load_tasks):
+                file_name, order_data = await next_entry
+                if isinstance(order_data, Exception):
+                    report_error(file_name, order_data)
+                    continue
+                
+                chunk.append((file_name, order_data))
+                if len(chunk) == batch_size:
+                    tasks.append(asyncio.create_task(process_chunk(chunk)))
+                    chunk = []
             
-            # Display summary
-            issues_found = analysis_results.get("issues_found", False)
-            total_issues = analysis_results.get("total_issues", 0)
-            status = f"🚨 {total_issues} issues found" if issues_found else "✅ No issues"
-            print(f"Completed: {status}")
+            if chunk:
+                tasks.append(asyncio.create_task(process_chunk(chunk)))
             
-        except Exception as e:
-            print(f"Error processing {file_name}: {str(e)}")
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        print(f"\nBatch processing complete. Results saved to {output_dir}")
+        if csv_report:
+            print(f"Consolidated report saved to {csv_report}")
+    finally:
+        await analyzer.aclose()
+
+def write_sample_order(output_dir: str, i: int) -> None:
+    """
+    Generate the i-th sample BOM order and save it to the output directory.
+    
+    Args:
+        output_dir: Directory to save the sample file
+        i: Sample number (1-based)
+    """
+    # Alternate between clean and problematic samples
+    include_issues = (i % 2 == 0)
+    
+    # Generate sample data
+    sample_data = generate_sample_orders(include_issues=include_issues)
     
-    print(f"\nBatch processing complete. Results saved to {output_dir}")
-    if csv_report:
-        print(f"Consolidated report saved to {csv_report}")
+    # Modify order ID to make each sample unique
+    sample_data["order_id"] = f"ORD-2025-{7800 + i}"
+    
+    # Add random variations to make samples more diverse
+    if i % 3 == 0:
+        sample_data["priority"] = "Medium"
+    elif i % 3 == 1:
+        sample_data["priority"] = "Low"
+    
+    # Save sample to file
+    status = "problematic" if include_issues else "clean"
+    filename = os.path.join(output_dir, f"sample_order_{i}_{status}.json")
+    
+    write_json_file(sample_data, filename)
 
 def generate_sample_batch(output_dir: str, num_samples: int = 5) -> None:
     """
@@ -147,28 +337,10 @@ def generate_sample_batch(output_dir: str, num_samples: int = 5) -> None:
     """
     os.makedirs(output_dir, exist_ok=True)
     
-    for i in range(1, num_samples + 1):
-        # Alternate between clean and problematic samples
-        include_issues = (i % 2 == 0)
-        
-        # Generate sample data
-        sample_data = generate_sample_orders(include_issues=include_issues)
-        
-        # Modify order ID to make each sample unique
-        sample_data["order_id"] = f"ORD-2025-{7800 + i}"
-        
-        # Add random variations to make samples more diverse
-        if i % 3 == 0:
-            sample_data["priority"] = "Medium"
-        elif i % 3 == 1:
-            sample_data["priority"] = "Low"
-        
-        # Save sample to file
-        status = "problematic" if include_issues else "clean"
-        filename = os.path.join(output_dir, f"sample_order_{i}_{status}.json")
-        
-        with open(filename, 'w') as f:
-            json.dump(sample_data, f, indent=2)
+    # File writes dominate, so issue them from a thread pool
+    with ThreadPoolExecutor(max_workers=max(1, min(32, num_samples))) as executor:
+        # Consume the results so any write error is raised here
+        list(executor.map(partial(write_sample_order, output_dir), range(1, num_samples + 1)))
     
     print(f"Generated {num_samples} sample files in {output_dir}")
 
@@ -188,9 +360,20 @@ def main():
     parser.add_argument('--reference-file', help='Path to reference data CSV file for item validation')
     parser.add_argument('--generate-reference', help='Generate sample reference data to specified file')
     parser.add_argument('--skip-local-validation', action='store_true', help='Skip local item validation (use only AI analysis)')
+    parser.add_argument('--always-llm', action='store_true', help='Run AI analysis even when local validation finds no issues')
+    parser.add_argument('--no-cache', action='store_true', help='Do not reuse cached model responses')
+    parser.add_argument('--max-concurrency', type=positive_int, default=16, help='Maximum number of API requests in flight at once (default: 16)')
+    parser.add_argument('--force', action='store_true', help='Reanalyze files that already have results in the output directory')
+    parser.add_argument('--max-retries', type=int, default=5, help='Retries for rate-limited or failed API requests (default: 5)')
+    parser.add_argument('--batch-size', type=positive_int, default=8, help='Maximum number of orders per API request (default: 8)')
     
     args = parser.parse_args()
     
+    # Show the item validator's progress messages; other loggers stay at WARNING, so
+    # httpx does not log every API request over the output
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger("item_validator").setLevel(logging.INFO)
+    
     # Generate samples if requested
     if args.generate_samples:
         generate_sample_batch(args.samples_dir, args.generate_samples)
@@ -200,7 +383,7 @@ def main():
     
     # Process batch if input directory is specified
     if args.input_dir:
-        process_batch(
+        asyncio.run(process_batch(
             args.input_dir, 
             args.output_dir, 
             args.csv,
@@ -210,8 +393,14 @@ def main():
             azure_deployment=args.azure_deployment,
             azure_api_version=args.azure_api_version,
             reference_file=args.reference_file,
-            skip_local_validation=args.skip_local_validation
-        )
+            skip_local_validation=args.skip_local_validation,
+            max_concurrency=args.max_concurrency,
+            use_cache=not args.no_cache,
+            batch_size=args.batch_size,
+            max_retries=args.max_retries,
+            force=args.force,
+            always_llm=args.always_llm
+        ))
     else:
         parser.print_help()
 
@@ -1,208 +1,372 @@
+import asyncio
 import json
 import os
-import csv
-import re
+import hashlib
+import importlib.util
+import sqlite3
+from collections import Counter
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Literal, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Literal, Tuple, Union
+import httpx
 import pandas as pd
-from openai import OpenAI, AzureOpenAI
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
+from pydantic import BaseModel
+from item_validator import ItemValidator
 
+# orjson is optional; it is several times faster than the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Sample data generation
-def generate_sample_orders(include_issues: bool = True) -> Dict[str, Any]:
-    """
-    Generate sample BOM order data with deliberate issues if specified.
+# Bump whenever the analysis prompt changes so cached responses are not reused
+PROMPT_VERSION = "5"
+
+# Connection pool settings shared by the API clients so connections are reused across calls
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=64)
+HTTP_TIMEOUT = httpx.Timeout(60.0)
+
+# HTTP/2 requires the optional h2 package
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# Synchronous API clients shared by analyzers with the same configuration, keyed by
+# (provider, api_key, azure_endpoint, azure_api_version, max_retries), so their
+# connection pools survive across analyzers. Async clients stay per analyzer because
+# their connections are bound to the event loop they were first used on.
+_CLIENT_CACHE: Dict[Tuple, Union[OpenAI, AzureOpenAI]] = {}
+
+# Fields every order item must have
+REQUIRED_FIELDS = frozenset({"line_id", "item_number", "description", "quantity", "unit_price", "category"})
+
+# Report icons by issue severity; anything else is shown as low
+SEVERITY_ICONS = {"high": "🔴", "medium": "🟠"}
+
+
+def dumps_json(data: Any, sort_keys: bool = False, indent: bool = False) -> bytes:
     """
-    base_order = {
-        "order_id": "ORD-2025-7834",
-        "customer": "Acme Electronics",
-        "date": "2025-02-26",
-        "priority": "High",
-        "items": [
-            {
-                "line_id": "L001",
-                "item_number": "PCB-X7700",
-                "description": "Main Circuit Board",
-                "quantity": 5,
-                "unit_price": 120.50,
-                "category": "Electronics"
-            },
-            {
-                "line_id": "L002",
-                "item_number": "CAP-3300-10V",
-                "description": "10V Capacitor",
-                "quantity": 50,
-                "unit_price": 0.75,
-                "category": "Components"
-            },
-            {
-                "line_id": "L003",
-                "item_number": "RES-2K-0.25W",
-                "description": "2K Ohm Resistor",
-                "quantity": 100,
-                "unit_price": 0.25,
-                "category": "Components"
-            }
-        ]
-    }
-    
-    if not include_issues:
-        return base_order
+    Serialize data to UTF-8 JSON bytes, compact unless indent is set.
     
-    # Create a version with issues
-    problematic_order = base_order.copy()
-    problematic_items = base_order["items"].copy()
+    Args:
+        data: JSON-serializable data
+        sort_keys: Sort object keys, for a canonical encoding
+        indent: Pretty-print with two-space indentation
+    """
+    if orjson:
+        option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option)
     
+    return json.dumps(
+        data, sort_keys=sort_keys, ensure_ascii=False,
+        indent=2 if indent else None, separators=None if indent else (',', ':')
+    ).encode()
+
+
+def loads_json(data: Union[str, bytes]) -> Any:
+    """
+    Parse JSON from a string or bytes.
+    """
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+# Analysis prompt pieces
+_PROMPT_INTRO = "You are a BOM (Bill of Materials) order validator.\n\n"
+
+_FULL_CHECKS = """Please analyze the following order data for issues such as:
+1. Missing required fields (all items should have line_id, item_number, description, quantity, unit_price, category)
+2. Incorrect item number formats
+3. Duplicate line IDs
+4. Any other anomalies or inconsistencies"""
+
+_RESIDUAL_CHECKS = """Missing required fields, item number formats and duplicate line IDs have already been
+checked, so do not report them. Only report other anomalies or inconsistencies, such as
+implausible quantities or prices, or descriptions that do not match the item or category."""
+
+_ANALYSIS_SCHEMA = """{
+    "issues_found": true/false,
+    "total_issues": <number of issues>,
+    "analysis": [
+        {
+            "issue_type": "<type of issue>",
+            "location": "<where in the order>",
+            "description": "<detailed description>",
+            "severity": "high/medium/low",
+            "recommendation": "<suggested fix>"
+        },
+        ...
+    ]
+}"""
+
+_BATCH_ANALYSIS_SCHEMA = """{
+    "results": [
+        {
+            "order_id": "<order_id of the analyzed order>",
+            "issues_found": true/false,
+            "total_issues": <number of issues>,
+            "analysis": [
+                {
+                    "issue_type": "<type of issue>",
+                    "location": "<where in the order>",
+                    "description": "<detailed description>",
+                    "severity": "high/medium/low",
+                    "recommendation": "<suggested fix>"
+                },
+                ...
+            ]
+        },
+        ...
+    ]
+}"""
+
+# Instructions keyed by whether only residual (non-mechanical) issues are requested.
+# They are sent ahead of the order data and never change, so providers can cache the prefix.
+_ORDER_INSTRUCTIONS = {
+    residual_only: (
+        _PROMPT_INTRO + checks
+        + "\n\nProvide a detailed analysis in JSON format with the following structure:\n"
+        + _ANALYSIS_SCHEMA
+        + "\n\nThe order data follows.\n"
+    )
+    for residual_only, checks in ((False, _FULL_CHECKS), (True, _RESIDUAL_CHECKS))
+}
+
+_BATCH_INSTRUCTIONS = {
+    residual_only: (
+        _PROMPT_INTRO + checks
+        + "\n\nAnalyze each order separately and return exactly one result per order. "
+        + "Provide the analysis in JSON format with the following structure:\n"
+        + _BATCH_ANALYSIS_SCHEMA
+        + "\n\nThe order data follows.\n"
+    )
+    for residual_only, checks in ((False, _FULL_CHECKS), (True, _RESIDUAL_CHECKS))
+}
+
+# Appended for providers without JSON mode
+_JSON_ONLY_INSTRUCTION = "Return only valid JSON, no additional text.\n"
+
+
+class AnalysisIssue(BaseModel):
+    """A single issue reported by the model."""
+    issue_type: str
+    location: str
+    description: str
+    severity: str
+    recommendation: str
+
+
+class OrderAnalysis(BaseModel):
+    """The model's analysis of one order within a batched request."""
+    order_id: Union[str, int]
+    issues_found: bool
+    total_issues: int
+    analysis: List[AnalysisIssue]
+
+
+class BatchAnalysis(BaseModel):
+    """The model's response to a batched request."""
+    results: List[OrderAnalysis]
+
+
+# Sample data generation
+_SAMPLE_ORDER = {
+    "order_id": "ORD-2025-7834",
+    "customer": "Acme Electronics",
+    "date": "2025-02-26",
+    "priority": "High",
+    "items": [
+        {
+            "line_id": "L001",
+            "item_number": "PCB-X7700",
+            "description": "Main Circuit Board",
+            "quantity": 5,
+            "unit_price": 120.50,
+            "category": "Electronics"
+        },
+        {
+            "line_id": "L002",
+            "item_number": "CAP-3300-10V",
+            "description": "10V Capacitor",
+            "quantity": 50,
+            "unit_price": 0.75,
+            "category": "Components"
+        },
+        {
+            "line_id": "L003",
+            "item_number": "RES-2K-0.25W",
+            "description": "2K Ohm Resistor",
+            "quantity": 100,
+            "unit_price": 0.25,
+            "category": "Components"
+        }
+    ]
+}
+
+_SAMPLE_ISSUE_ITEMS = [
     # Issue 1: Missing entry (missing unit_price)
-    problematic_items.append({
+    {
         "line_id": "L004",
         "item_number": "IC-8085",
         "description": "Microprocessor",
         "quantity": 2,
         # unit_price is missing
         "category": "Electronics"
-    })
-    
+    },
     # Issue 2: Wrong item number format
-    problematic_items.append({
+    {
         "line_id": "L005",
         "item_number": "CONN-7777",  # Should be CONN-DB9-F
         "description": "DB9 Female Connector",
         "quantity": 10,
         "unit_price": 1.20,
         "category": "Connectors"
-    })
-    
+    },
     # Issue 3: Duplicate line_id
-    problematic_items.append({
+    {
         "line_id": "L003",  # Duplicate line_id
         "item_number": "DIODE-1N4001",
         "description": "1A Diode",
         "quantity": 25,
         "unit_price": 0.15,
         "category": "Components"
-    })
+    }
+]
+
+# Item lists per sample variant; items only hold scalars, so dict() is a full copy
+_CLEAN_SAMPLE_ITEMS = tuple(_SAMPLE_ORDER["items"])
+_PROBLEMATIC_SAMPLE_ITEMS = _CLEAN_SAMPLE_ITEMS + tuple(_SAMPLE_ISSUE_ITEMS)
+
+
+def generate_sample_orders(include_issues: bool = True) -> Dict[str, Any]:
+    """
+    Generate sample BOM order data with deliberate issues if specified.
     
-    problematic_order["items"] = problematic_items
-    return problematic_order
+    Each call returns a fresh copy that callers may modify.
+    """
+    items = _PROBLEMATIC_SAMPLE_ITEMS if include_issues else _CLEAN_SAMPLE_ITEMS
+    return {**_SAMPLE_ORDER, "items": [dict(item) for item in items]}
 
 
-class ItemValidator:
+class ResponseCache:
     """
-    Validates BOM item numbers against reference data and pattern rules.
+    Persistent cache of model responses backed by a SQLite file.
+    
+    Responses read or written during the session are also kept in memory, so repeated
+    lookups do not go back to the database.
     """
-    def __init__(self, reference_file: Optional[str] = None):
+    def __init__(self, path: str = ".bom_cache"):
         """
-        Initialize the validator with optional reference data.
+        Open (or create) the cache database.
         
         Args:
-            reference_file: Path to CSV file with reference data
-        """
-        self.reference_items = {}
-        self.item_patterns = {
-            "PCB": r"^PCB-[A-Z]\d{4}$",            # PCB-X7700
-            "CAP": r"^CAP-\d{4}-\d{1,3}V$",        # CAP-3300-10V
-            "RES": r"^RES-\d+[KM]?-\d+\.\d+W$",    # RES-2K-0.25W
-            "IC": r"^IC-\d{4}[A-Z]?$",             # IC-8085
-            "CONN": r"^CONN-[A-Z0-9]+-[MF]$",      # CONN-DB9-F
-            "DIODE": r"^DIODE-\d{1}N\d{4}$",       # DIODE-1N4001
-        }
-        
-        if reference_file and os.path.exists(reference_file):
-            self.load_reference_data(reference_file)
+            path: Path to the SQLite cache file
+        """
+        self.path = path
+        self.memory = {}
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+        )
+        self.conn.commit()
     
-    def load_reference_data(self, filename: str) -> None:
+    def get(self, key: str) -> Optional[str]:
         """
-        Load reference data from a CSV file.
+        Return the cached response for a key, or None on a miss.
+        """
+        response = self.memory.get(key)
+        if response is not None:
+            return response
+        
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
         
-        Expected CSV format:
-        item_number,description,category
+        self.memory[key] = row[0]
+        return row[0]
+    
+    def set(self, key: str, response: str) -> None:
         """
-        try:
-            with open(filename, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    self.reference_items[row['item_number']] = {
-                        'description': row['description'],
-                        'category': row['category']
-                    }
-            print(f"Loaded {len(self.reference_items)} reference items")
-        except Exception as e:
-            print(f"Error loading reference data: {str(e)}")
+        Store a response under a key.
+        """
+        self.memory[key] = response
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)", (key, response)
+            )
     
-    def validate_item_number(self, item_number: str) -> Tuple[bool, str]:
+    def close(self) -> None:
         """
-        Validate an item number against patterns and reference data.
-        
-        Returns:
-            Tuple of (is_valid, error_message)
+        Close the underlying database connection.
         """
-        # Check if it exists in reference data
-        if item_number in self.reference_items:
-            return True, ""
-        
-        # Check if it matches any pattern
-        prefix = item_number.split('-')[0] if '-' in item_number else ""
-        
-        if prefix in self.item_patterns:
-            pattern = self.item_patterns[prefix]
-            if re.match(pattern, item_number):
-                return True, ""
-            else:
-                return False, f"Item number {item_number} does not match expected pattern {pattern}"
-        
-        return False, f"Unknown item number prefix: {prefix}"
+        self.conn.close()
+
+
+class CsvReporter:
+    """
+    Collects analysis results for a CSV report and writes them on each flush and on exit.
+    
+    Usage:
+        with CsvReporter("report.csv") as reporter:
+            reporter.append(order_id, analysis)
+    """
+    fieldnames = ['timestamp', 'order_id', 'issue_id', 'issue_type', 
+                  'location', 'severity', 'description', 'recommendation']
     
-    def suggest_correction(self, item_number: str) -> Optional[str]:
+    def __init__(self, filename: str):
         """
-        Suggest a correction for an invalid item number.
-        
-        Returns:
-            Suggested correct item number or None
+        Args:
+            filename: Path to the CSV file
         """
-        prefix = item_number.split('-')[0] if '-' in item_number else ""
-        
-        # Simple correction for common prefixes
-        if prefix == "CONN" and not item_number.endswith("-M") and not item_number.endswith("-F"):
-            # Missing gender indicator
-            return f"{item_number}-F"
-        
-        # Check reference data for similar items
-        similar_items = []
-        for ref_item in self.reference_items:
-            if prefix in ref_item:
-                similar_items.append(ref_item)
-        
-        if similar_items:
-            return similar_items[0]  # Return first similar item
-        
-        return None
+        self.filename = filename
+        self.rows = []
     
-    def generate_reference_data(self, output_file: str) -> None:
+    def __enter__(self) -> "CsvReporter":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # Rows collected before an error are still written
+        self.flush()
+    
+    def flush(self) -> None:
         """
-        Generate sample reference data file.
+        Append the collected rows to the CSV file, writing the header if the file is new.
         """
-        reference_data = [
-            ["item_number", "description", "category"],
-            ["PCB-X7700", "Main Circuit Board", "Electronics"],
-            ["CAP-3300-10V", "10V Capacitor", "Components"],
-            ["RES-2K-0.25W", "2K Ohm Resistor", "Components"],
-            ["IC-8085", "Microprocessor", "Electronics"],
-            ["CONN-DB9-F", "DB9 Female Connector", "Connectors"],
-            ["CONN-DB9-M", "DB9 Male Connector", "Connectors"],
-            ["DIODE-1N4001", "1A Diode", "Components"],
-            ["PCB-A1234", "Power Supply Board", "Electronics"],
-            ["CAP-2200-25V", "25V Capacitor", "Components"],
-            ["RES-10K-0.50W", "10K Ohm Resistor", "Components"]
-        ]
+        with open(self.filename, 'a', newline='') as f:
+            # An empty file is new and needs the header
+            write_header = f.tell() == 0
+            if self.rows or write_header:
+                pd.DataFrame(self.rows, columns=self.fieldnames).to_csv(
+                    f, header=write_header, index=False, lineterminator='\r\n'
+                )
+        self.rows = []
+    
+    def append(self, order_id: str, analysis: Dict[str, Any]) -> None:
+        """
+        Add the rows for one analyzed order.
         
-        try:
-            with open(output_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerows(reference_data)
-            print(f"Generated reference data saved to {output_file}")
-        except Exception as e:
-            print(f"Error generating reference data: {str(e)}")
+        Args:
+            order_id: The ID of the analyzed order
+            analysis: The analysis results dictionary
+        """
+        timestamp = datetime.now().isoformat(sep=" ", timespec="seconds")
+        
+        # Rows are tuples in fieldnames order
+        if not analysis.get("issues_found", False):
+            # Write a single row for no issues
+            self.rows.append(
+                (timestamp, order_id, 'N/A', 'None', 'N/A', 'N/A', 'No issues found', 'N/A')
+            )
+        else:
+            # Write each issue as a separate row
+            for i, issue in enumerate(analysis.get("analysis", []), 1):
+                self.rows.append((
+                    timestamp,
+                    order_id,
+                    f"{order_id}-{i}",
+                    issue.get('issue_type', 'Unknown'),
+                    issue.get('location', 'Unknown'),
+                    issue.get('severity', 'Unknown'),
+                    issue.get('description', ''),
+                    issue.get('recommendation', '')
+                ))
 
 
 class BOMAnalyzer:
@@ -214,7 +378,10 @@ class BOMAnalyzer:
         azure_endpoint: Optional[str] = None,
         azure_deployment: Optional[str] = None,
         azure_api_version: str = "2024-02-01",
-        reference_file: Optional[str] = None
+        reference_file: Optional[str] = None,
+        cache_path: Optional[str] = None,
+        max_retries: int = 5,
+        always_llm: bool = False
     ):
         """
         Initialize the BOM Analyzer with API configuration.
@@ -227,26 +394,86 @@ class BOMAnalyzer:
             azure_deployment: Azure OpenAI deployment name (required if provider is "azure")
             azure_api_version: Azure OpenAI API version
             reference_file: Path to CSV file with reference data for item validation
+            cache_path: Path to a response cache file; caching is disabled if None
+            max_retries: Retries for rate-limited, timed-out or failed API requests
+            always_llm: Send orders to the model even when local validation finds no issues,
+                e.g. for audits
         """
         self.model = model
         self.provider = provider
+        self.always_llm = always_llm
+        
+        # Keep-alive connection pools avoid a TCP/TLS handshake per request
+        http_kwargs = {"http2": HTTP2_ENABLED, "limits": HTTP_LIMITS, "timeout": HTTP_TIMEOUT}
+        
+        # The SDK retries connection errors, timeouts, 429s and 5xx responses
+        # with exponential backoff and jitter
+        client_kwargs = {"max_retries": max_retries}
         
         if provider == "azure":
             if not azure_endpoint or not azure_deployment:
                 raise ValueError("Azure endpoint and deployment name are required when using Azure OpenAI")
                 
-            self.client = AzureOpenAI(
-                api_key=api_key or os.environ.get("AZURE_OPENAI_API_KEY"),
-                api_version=azure_api_version,
-                azure_endpoint=azure_endpoint or os.environ.get("AZURE_OPENAI_ENDPOINT")
-            )
+            azure_kwargs = {
+                "api_key": api_key or os.environ.get("AZURE_OPENAI_API_KEY"),
+                "api_version": azure_api_version,
+                "azure_endpoint": azure_endpoint or os.environ.get("AZURE_OPENAI_ENDPOINT"),
+                **client_kwargs
+            }
+            client_key = ("azure", azure_kwargs["api_key"], azure_kwargs["azure_endpoint"], azure_api_version, max_retries)
+            if client_key not in _CLIENT_CACHE:
+                _CLIENT_CACHE[client_key] = AzureOpenAI(**azure_kwargs, http_client=httpx.Client(**http_kwargs))
+            self.client = _CLIENT_CACHE[client_key]
+            self.async_client = AsyncAzureOpenAI(**azure_kwargs, http_client=httpx.AsyncClient(**http_kwargs))
             self.azure_deployment = azure_deployment
         else:
-            self.client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+            openai_api_key = api_key or os.environ.get("OPENAI_API_KEY")
+            client_key = ("openai", openai_api_key, None, None, max_retries)
+            if client_key not in _CLIENT_CACHE:
+                _CLIENT_CACHE[client_key] = OpenAI(
+                    api_key=openai_api_key, http_client=httpx.Client(**http_kwargs), **client_kwargs
+                )
+            self.client = _CLIENT_CACHE[client_key]
+            self.async_client = AsyncOpenAI(
+                api_key=openai_api_key, http_client=httpx.AsyncClient(**http_kwargs), **client_kwargs
+            )
             self.azure_deployment = None
             
         # Initialize item validator
         self.item_validator = ItemValidator(reference_file)
+        
+        # Initialize response cache
+        self.cache = ResponseCache(cache_path) if cache_path else None
+    
+    def close(self) -> None:
+        """
+        Release the analyzer's response cache.
+        
+        The shared synchronous API client stays open for other analyzers with the same
+        configuration. Use aclose from async code to release the async client as well.
+        """
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+    
+    async def aclose(self) -> None:
+        """
+        Close the analyzer's async API client and its connection pool, then release the
+        response cache; await it on the event loop the async client was used on.
+        """
+        await self.async_client.close()
+        self.close()
+    
+    def _cache_key(self, order_data: Dict[str, Any], residual_only: bool = False) -> str:
+        """
+        Compute the cache key for an order from its canonical JSON, the model and the prompt version.
+        """
+        # Always the stdlib encoder: orjson formats some floats differently (1e20 vs 1e+20),
+        # and keys must not depend on which encoder is installed
+        canonical = json.dumps(order_data, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode()
+        model = self.azure_deployment if self.provider == "azure" else self.model
+        prompt_version = f"{PROMPT_VERSION}-residual" if residual_only else PROMPT_VERSION
+        return hashlib.sha256(canonical + f"|{model}|{prompt_version}".encode()).hexdigest()
     
     def validate_item_numbers(self, order_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
@@ -261,35 +488,263 @@ class BOMAnalyzer:
         validation_issues = []
         
         for item in order_data.get("items", []):
-            item_number = item.get("item_number")
-            if not item_number:
-                continue
-                
-            valid, error_message = self.item_validator.validate_item_number(item_number)
-            
-            if not valid:
-                line_id = item.get("line_id", "unknown")
-                suggestion = self.item_validator.suggest_correction(item_number)
-                
-                issue = {
-                    "issue_type": "Invalid Item Number",
-                    "location": f"Line ID {line_id}",
-                    "description": error_message,
-                    "severity": "medium",
-                    "recommendation": "Check and correct item number format" + 
-                                     (f" (suggested: {suggestion})" if suggestion else "")
-                }
+            issue = self._item_number_issue(item)
+            if issue:
                 validation_issues.append(issue)
         
         return validation_issues
     
+    def _item_number_issue(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Validate a single item's number, returning an issue if it is invalid.
+        """
+        item_number = item.get("item_number")
+        if not item_number:
+            return None
+            
+        valid, error_message = self.item_validator.validate_item_number(item_number)
+        if valid:
+            return None
+        
+        line_id = item.get("line_id", "unknown")
+        suggestion = self.item_validator.suggest_correction(item_number)
+        
+        return {
+            "issue_type": "Invalid Item Number",
+            "location": f"Line ID {line_id}",
+            "description": error_message,
+            "severity": "medium",
+            "recommendation": "Check and correct item number format" + 
+                             (f" (suggested: {suggestion})" if suggestion else "")
+        }
+    
+    def _missing_field_issues(self, item: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Report every required field missing from a single item.
+        """
+        line_id = item.get("line_id", "unknown")
+        return [
+            {
+                "issue_type": "Missing Field",
+                "location": f"Line ID {line_id}",
+                "description": f"Missing required field '{field}'",
+                "severity": "high",
+                "recommendation": f"Add {field} field to complete the entry"
+            }
+            for field in sorted(REQUIRED_FIELDS - item.keys())
+        ]
+    
+    def _duplicate_issues(self, line_id_counts: Counter) -> List[Dict[str, Any]]:
+        """
+        Report every line ID counted more than once.
+        """
+        return [
+            {
+                "issue_type": "Duplicate Line ID",
+                "location": f"Line ID {line_id}",
+                "description": f"Line ID {line_id} is used by {count} items",
+                "severity": "high",
+                "recommendation": "Assign a unique line_id to each item"
+            }
+            for line_id, count in line_id_counts.items()
+            if count > 1
+        ]
+    
+    def _check_missing_fields(self, order_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Report every required field missing from an order item.
+        
+        Args:
+            order_data: BOM order data dictionary
+            
+        Returns:
+            List of validation issues found
+        """
+        validation_issues = []
+        for item in order_data.get("items", []):
+            validation_issues.extend(self._missing_field_issues(item))
+        return validation_issues
+    
+    def _check_duplicates(self, order_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Report every line ID used by more than one item of an order.
+        
+        Args:
+            order_data: BOM order data dictionary
+            
+        Returns:
+            List of validation issues found
+        """
+        return self._duplicate_issues(
+            Counter(item["line_id"] for item in order_data.get("items", []) if "line_id" in item)
+        )
+    
+    def _local_validate(self, order_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Run the deterministic checks: missing fields, duplicate line IDs and item number formats.
+        
+        Args:
+            order_data: BOM order data dictionary
+            
+        Returns:
+            List of validation issues found
+        """
+        return (
+            self._check_missing_fields(order_data)
+            + self._check_duplicates(order_data)
+            + self.validate_item_numbers(order_data)
+        )
+    
+    def validate_items_stream(self, items: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run the local validators over items that are consumed one at a time, e.g. streamed
+        from a file too large to load, so only the line ID counts are kept in memory.
+        
+        Args:
+            items: Order items, consumed once
+            
+        Returns:
+            List of validation issues found, in the same order as _local_validate
+        """
+        missing_field_issues = []
+        item_number_issues = []
+        line_id_counts = Counter()
+        
+        for item in items:
+            missing_field_issues.extend(self._missing_field_issues(item))
+            if "line_id" in item:
+                line_id_counts[item["line_id"]] += 1
+            issue = self._item_number_issue(item)
+            if issue:
+                item_number_issues.append(issue)
+        
+        return missing_field_issues + self._duplicate_issues(line_id_counts) + item_number_issues
+    
+    def _completion_request(self, instructions: str, data_json: str) -> Dict[str, Any]:
+        """
+        Build the chat completion arguments for the configured provider.
+        
+        The constant instructions always come first and the order data last, so
+        consecutive requests share the longest possible prompt prefix.
+        
+        Args:
+            instructions: Fixed instruction block
+            data_json: Serialized order data
+        """
+        # Handle different API providers
+        if self.provider == "azure":
+            # Not every Azure deployment (e.g. o1-mini) supports system messages or JSON mode,
+            # so send everything as one user message and ask for JSON in the prompt
+            return {
+                "model": self.azure_deployment,  # For Azure, use deployment name instead of model
+                "messages": [
+                    {"role": "user", "content": instructions + _JSON_ONLY_INSTRUCTION + "\n" + data_json}
+                ]
+                # "temperature": 0.1  # Low temperature for more deterministic output
+            }
+        
+        # The output schema is fixed, so low reasoning effort suffices and JSON mode guarantees parseable output
+        return {
+            "model": self.model,
+            "reasoning_effort": "low",
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": instructions},
+                {"role": "user", "content": data_json}
+            ]
+            # "temperature": 0.1  # Low temperature for more deterministic output
+        }
+    
+    def _build_request(self, order_data: Dict[str, Any], residual_only: bool = False) -> Dict[str, Any]:
+        """
+        Build the chat completion arguments for analyzing an order.
+        
+        Args:
+            order_data: BOM order data dictionary
+            residual_only: Only ask for issues the local validators cannot detect
+            
+        Returns:
+            Keyword arguments for chat.completions.create
+        """
+        # Compact JSON: the model does not need it pretty-printed and it saves tokens
+        order_json = dumps_json(order_data).decode()
+        
+        return self._completion_request(_ORDER_INSTRUCTIONS[residual_only], order_json)
+    
+    def _build_batch_request(self, orders: List[Dict[str, Any]], residual_only: bool = False) -> Dict[str, Any]:
+        """
+        Build the chat completion arguments for analyzing several orders in one request.
+        
+        Args:
+            orders: BOM order data dictionaries with unique order IDs
+            residual_only: Only ask for issues the local validators cannot detect
+            
+        Returns:
+            Keyword arguments for chat.completions.create
+        """
+        orders_json = dumps_json({"orders": orders}).decode()
+        
+        return self._completion_request(_BATCH_INSTRUCTIONS[residual_only], orders_json)
+    
+    def _combine_results(self, result_text: str, validation_issues: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Parse the model response and merge it with local validation issues.
+        """
+        ai_analysis = loads_json(result_text)
+        
+        # Combine AI analysis with local validation results
+        if validation_issues and ai_analysis.get("issues_found", False):
+            ai_analysis["analysis"].extend(validation_issues)
+            ai_analysis["total_issues"] = len(ai_analysis["analysis"])
+        elif validation_issues:
+            ai_analysis = {
+                "issues_found": True,
+                "total_issues": len(validation_issues),
+                "analysis": validation_issues
+            }
+            
+        return ai_analysis
+    
+    def _error_results(self, error: Exception, validation_issues: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the results returned when the API call fails.
+        
+        The results carry the error under "api_error", so callers can tell them from a
+        completed analysis and retry the order later.
+        """
+        # If there's an error with the API but we have validation results, return those
+        if validation_issues:
+            return {
+                "issues_found": True,
+                "total_issues": len(validation_issues),
+                "analysis": validation_issues,
+                "api_error": str(error)
+            }
+        
+        # Otherwise return an error
+        return {
+            "issues_found": True,
+            "total_issues": 1,
+            "analysis": [
+                {
+                    "issue_type": "API Error",
+                    "location": "System",
+                    "description": f"Error calling OpenAI API: {str(error)}",
+                    "severity": "high",
+                    "recommendation": "Check API key and connectivity"
+                }
+            ],
+            "api_error": str(error)
+        }
+    
     def analyze_order(self, order_data: Dict[str, Any], use_local_validation: bool = True) -> Dict[str, Any]:
         """
         Analyze BOM order data for discrepancies using OpenAI's o3-mini model.
         
         Args:
             order_data: BOM order data dictionary
-            use_local_validation: Whether to use local item number validation
+            use_local_validation: Whether to run the local validators first; orders that
+                pass them are returned without calling the API unless always_llm is set
             
         Returns:
             Analysis results dictionary
@@ -297,104 +752,290 @@ class BOMAnalyzer:
         # First perform local validation if enabled
         validation_issues = []
         if use_local_validation:
-            validation_issues = self.validate_item_numbers(order_data)
+            validation_issues = self._local_validate(order_data)
+            
+            # Clean orders need no further analysis
+            if not validation_issues and not self.always_llm:
+                return {"issues_found": False, "total_issues": 0, "analysis": []}
         
-        # Prepare the prompt for the model
-        order_json = json.dumps(order_data, indent=2)
+        cache_key = self._cache_key(order_data, use_local_validation) if self.cache else None
         
-        prompt = f"""
-        You are a BOM (Bill of Materials) order validator.
+        try:
+            result_text = self.cache.get(cache_key) if self.cache else None
+            cached = result_text is not None
+            
+            if not cached:
+                response = self.client.chat.completions.create(**self._build_request(order_data, use_local_validation))
+                result_text = response.choices[0].message.content
+            
+            # Extract and parse the JSON response
+            results = self._combine_results(result_text, validation_issues)
+            
+            # Only cache responses that parse successfully
+            if self.cache and not cached:
+                self.cache.set(cache_key, result_text)
+            
+            return results
         
-        Please analyze the following order data for issues such as:
-        1. Missing required fields (all items should have line_id, item_number, description, quantity, unit_price, category)
-        2. Incorrect item number formats
-        3. Duplicate line IDs
-        4. Any other anomalies or inconsistencies
+        except Exception as e:
+            return self._error_results(e, validation_issues)
+    
+    async def analyze_order_async(self, order_data: Dict[str, Any], use_local_validation: bool = True) -> Dict[str, Any]:
+        """
+        Asynchronous variant of analyze_order for running many analyses concurrently.
         
-        Order data:
-        {order_json}
+        Args:
+            order_data: BOM order data dictionary
+            use_local_validation: Whether to run the local validators first
+            
+        Returns:
+            Analysis results dictionary
+        """
+        validation_issues = []
+        if use_local_validation:
+            validation_issues = self._local_validate(order_data)
+            if not validation_issues and not self.always_llm:
+                return {"issues_found": False, "total_issues": 0, "analysis": []}
         
-        Provide a detailed analysis in JSON format with the following structure:
-        {{
-            "issues_found": true/false,
-            "total_issues": <number of issues>,
-            "analysis": [
-                {{
-                    "issue_type": "<type of issue>",
-                    "location": "<where in the order>",
-                    "description": "<detailed description>",
-                    "severity": "high/medium/low",
-                    "recommendation": "<suggested fix>"
-                }},
-                ...
-            ]
-        }}
+        cache_key = self._cache_key(order_data, use_local_validation) if self.cache else None
         
-        Return only valid JSON, no additional text.
+        try:
+            result_text = self.cache.get(cache_key) if self.cache else None
+            cached = result_text is not None
+            
+            if not cached:
+                response = await self.async_client.chat.completions.create(**self._build_request(order_data, use_local_validation))
+                result_text = response.choices[0].message.content
+            
+            results = self._combine_results(result_text, validation_issues)
+            if self.cache and not cached:
+                self.cache.set(cache_key, result_text)
+            
+            return results
+        
+        except Exception as e:
+            return self._error_results(e, validation_issues)
+    
+    def _prepare_batch(
+        self, orders: List[Dict[str, Any]], use_local_validation: bool
+    ) -> Tuple[List[Optional[Dict[str, Any]]], List[List[Dict[str, Any]]], List[int]]:
         """
+        Resolve the orders that need no API call.
         
-        try:
-            # Handle different API providers
-            if self.provider == "azure":
-                response = self.client.chat.completions.create(
-                    model=self.azure_deployment,  # For Azure, use deployment name instead of model
-                    messages=[
-                        # {"role": "system", "content": "You are a BOM validator assistant that identifies issues in order data."},
-                        {"role": "user", "content": prompt}
-                    ]
-                    # temperature=0.1  # Low temperature for more deterministic output
-                )
-            else:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    reasoning_effort="medium",
-                    messages=[
-                        # {"role": "system", "content": "You are a BOM validator assistant that identifies issues in order data."},
-                        {"role": "user", "content": prompt}
-                    ]
-                    # temperature=0.1  # Low temperature for more deterministic output
-                )
+        Returns:
+            Tuple of (results with None for unresolved orders, local validation issues
+            per order, indices of orders still needing analysis)
+        """
+        results = [None] * len(orders)
+        validation = []
+        pending = []
+        
+        for i, order_data in enumerate(orders):
+            validation_issues = []
+            validation.append(validation_issues)
             
-            # Extract and parse the JSON response
-            result_text = response.choices[0].message.content
-            ai_analysis = json.loads(result_text)
-            
-            # Combine AI analysis with local validation results
-            if validation_issues and ai_analysis.get("issues_found", False):
-                ai_analysis["analysis"].extend(validation_issues)
-                ai_analysis["total_issues"] = len(ai_analysis["analysis"])
-            elif validation_issues:
-                ai_analysis = {
-                    "issues_found": True,
-                    "total_issues": len(validation_issues),
-                    "analysis": validation_issues
-                }
+            # A malformed order fails on its own instead of failing the whole batch
+            try:
+                if use_local_validation:
+                    validation_issues.extend(self._local_validate(order_data))
+                    if not validation_issues and not self.always_llm:
+                        results[i] = {"issues_found": False, "total_issues": 0, "analysis": []}
+                        continue
                 
-            return ai_analysis
+                if self.cache:
+                    result_text = self.cache.get(self._cache_key(order_data, use_local_validation))
+                    if result_text is not None:
+                        results[i] = self._combine_results(result_text, validation_issues)
+                        continue
+            except Exception as e:
+                results[i] = self._error_results(e, validation_issues)
+                continue
+            
+            pending.append(i)
         
-        except Exception as e:
-            # If there's an error with the API but we have validation results, return those
-            if validation_issues:
-                return {
-                    "issues_found": True,
-                    "total_issues": len(validation_issues),
-                    "analysis": validation_issues
-                }
+        return results, validation, pending
+    
+    def _batch_chunks(self, orders: List[Dict[str, Any]], pending: List[int], batch_size: int) -> List[List[int]]:
+        """
+        Group pending order indices into chunks whose order IDs are unique.
+        
+        Orders without an order_id get a chunk of their own, since results are matched by ID.
+        """
+        # A zero batch size would emit an empty chunk and pay for a request with no orders
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        
+        chunks = []
+        current = []
+        current_ids = set()
+        
+        for i in pending:
+            order_id = orders[i].get("order_id")
+            if order_id is None:
+                chunks.append([i])
+                continue
             
-            # Otherwise return an error
-            return {
-                "issues_found": True,
-                "total_issues": 1,
-                "analysis": [
-                    {
-                        "issue_type": "API Error",
-                        "location": "System",
-                        "description": f"Error calling OpenAI API: {str(e)}",
-                        "severity": "high",
-                        "recommendation": "Check API key and connectivity"
-                    }
-                ]
-            }
+            if str(order_id) in current_ids or len(current) >= batch_size:
+                chunks.append(current)
+                current = []
+                current_ids = set()
+            
+            current.append(i)
+            current_ids.add(str(order_id))
+        
+        if current:
+            chunks.append(current)
+        
+        return chunks
+    
+    def _apply_batch_results(
+        self,
+        orders: List[Dict[str, Any]],
+        chunk: List[int],
+        validation: List[List[Dict[str, Any]]],
+        results: List[Optional[Dict[str, Any]]],
+        result_text: str,
+        use_local_validation: bool
+    ) -> List[int]:
+        """
+        Map a batched model response back onto the orders of a chunk.
+        
+        Returns:
+            Indices of orders missing from the response, to be analyzed individually
+        """
+        try:
+            batch_analysis = BatchAnalysis.model_validate_json(result_text)
+        except ValueError:
+            return list(chunk)
+        
+        by_order_id = {str(result.order_id): result for result in batch_analysis.results}
+        missing = []
+        
+        for i in chunk:
+            order_data = orders[i]
+            result = by_order_id.get(str(order_data.get("order_id")))
+            if result is None:
+                missing.append(i)
+                continue
+            
+            order_text = result.model_dump_json(exclude={"order_id"})
+            results[i] = self._combine_results(order_text, validation[i])
+            if self.cache:
+                self.cache.set(self._cache_key(order_data, use_local_validation), order_text)
+        
+        return missing
+    
+    def analyze_orders_batch(
+        self, orders: List[Dict[str, Any]], batch_size: int = 8, use_local_validation: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze several orders, packing up to batch_size of them into each API request.
+        
+        Args:
+            orders: BOM order data dictionaries
+            batch_size: Maximum number of orders per request
+            use_local_validation: Whether to run the local validators first
+            
+        Returns:
+            Analysis results dictionaries, in the same order as the input
+        """
+        results, validation, pending = self._prepare_batch(orders, use_local_validation)
+        
+        for chunk in self._batch_chunks(orders, pending, batch_size):
+            if len(chunk) == 1:
+                results[chunk[0]] = self.analyze_order(orders[chunk[0]], use_local_validation)
+                continue
+            
+            request = self._build_batch_request([orders[i] for i in chunk], use_local_validation)
+            try:
+                response = self.client.chat.completions.create(**request)
+            except Exception as e:
+                for i in chunk:
+                    results[i] = self._error_results(e, validation[i])
+                continue
+            
+            missing = self._apply_batch_results(
+                orders, chunk, validation, results, response.choices[0].message.content, use_local_validation
+            )
+            for i in missing:
+                results[i] = self.analyze_order(orders[i], use_local_validation)
+        
+        return results
+    
+    async def analyze_orders_batch_async(
+        self,
+        orders: List[Dict[str, Any]],
+        batch_size: int = 8,
+        use_local_validation: bool = True,
+        semaphore: Optional[asyncio.Semaphore] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Asynchronous variant of analyze_orders_batch; the requests for all chunks run concurrently.
+        
+        Args:
+            orders: BOM order data dictionaries
+            batch_size: Maximum number of orders per request
+            use_local_validation: Whether to run the local validators first
+            semaphore: Held for every API request, including the per-order fallbacks, so
+                callers can bound the requests in flight across several calls
+            
+        Returns:
+            Analysis results dictionaries, in the same order as the input
+        """
+        results, validation, pending = self._prepare_batch(orders, use_local_validation)
+        # Without a caller's semaphore no chunk ever waits: there are at most len(orders) requests in flight
+        limit = semaphore if semaphore is not None else asyncio.Semaphore(max(len(orders), 1))
+        
+        async def analyze_one(i: int) -> None:
+            async with limit:
+                results[i] = await self.analyze_order_async(orders[i], use_local_validation)
+        
+        async def analyze_chunk(chunk: List[int]) -> None:
+            if len(chunk) == 1:
+                await analyze_one(chunk[0])
+                return
+            
+            try:
+                request = self._build_batch_request([orders[i] for i in chunk], use_local_validation)
+                async with limit:
+                    response = await self.async_client.chat.completions.create(**request)
+            except Exception as e:
+                for i in chunk:
+                    results[i] = self._error_results(e, validation[i])
+                return
+            
+            missing = self._apply_batch_results(
+                orders, chunk, validation, results, response.choices[0].message.content, use_local_validation
+            )
+            for i in missing:
+                await analyze_one(i)
+        
+        await asyncio.gather(*(analyze_chunk(chunk) for chunk in self._batch_chunks(orders, pending, batch_size)))
+        return results
+    
+    async def analyze_orders_parallel(
+        self, orders: List[Dict[str, Any]], max_concurrency: int = 8, use_local_validation: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze several orders with one request per order, up to max_concurrency at a time.
+        
+        Each order falls back to its local validation results on its own if its request fails.
+        
+        Args:
+            orders: BOM order data dictionaries
+            max_concurrency: Maximum number of requests in flight
+            use_local_validation: Whether to run the local validators first
+        
+        Returns:
+            Analysis results dictionaries, in the same order as the input
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def analyze_one(order_data: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.analyze_order_async(order_data, use_local_validation)
+        
+        return await asyncio.gather(*(analyze_one(order_data) for order_data in orders))
     
     def format_analysis_report(self, analysis: Dict[str, Any]) -> str:
         """
@@ -403,17 +1044,19 @@ class BOMAnalyzer:
         if not analysis.get("issues_found", False):
             return "✅ No issues found in the BOM order data."
         
-        report = f"🚨 Found {analysis.get('total_issues', 0)} issues in the BOM order:\n\n"
+        parts = [f"🚨 Found {analysis.get('total_issues', 0)} issues in the BOM order:\n\n"]
         
         for i, issue in enumerate(analysis.get("analysis", []), 1):
-            severity_icon = "🔴" if issue.get("severity") == "high" else "🟠" if issue.get("severity") == "medium" else "🟡"
+            severity_icon = SEVERITY_ICONS.get(issue.get("severity"), "🟡")
             
-            report += f"{severity_icon} Issue #{i}: {issue.get('issue_type')}\n"
-            report += f"   Location: {issue.get('location')}\n"
-            report += f"   Description: {issue.get('description')}\n"
-            report += f"   Recommendation: {issue.get('recommendation')}\n\n"
+            parts.append(
+                f"{severity_icon} Issue #{i}: {issue.get('issue_type')}\n"
+                f"   Location: {issue.get('location')}\n"
+                f"   Description: {issue.get('description')}\n"
+                f"   Recommendation: {issue.get('recommendation')}\n\n"
+            )
         
-        return report
+        return "".join(parts)
         
     def save_analysis_to_csv(self, order_id: str, analysis: Dict[str, Any], filename: str) -> None:
         """
@@ -424,46 +1067,27 @@ class BOMAnalyzer:
             analysis: The analysis results dictionary
             filename: Path to save the CSV file
         """
-        file_exists = os.path.isfile(filename)
-        
-        with open(filename, 'a', newline='') as csvfile:
-            fieldnames = ['timestamp', 'order_id', 'issue_id', 'issue_type', 
-                         'location', 'severity', 'description', 'recommendation']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            if not file_exists:
-                writer.writeheader()
-            
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            if not analysis.get("issues_found", False):
-                # Write a single row for no issues
-                writer.writerow({
-                    'timestamp': timestamp,
-                    'order_id': order_id,
-                    'issue_id': 'N/A',
-                    'issue_type': 'None',
-                    'location': 'N/A',
-                    'severity': 'N/A',
-                    'description': 'No issues found',
-                    'recommendation': 'N/A'
-                })
-            else:
-                # Write each issue as a separate row
-                for i, issue in enumerate(analysis.get("analysis", []), 1):
-                    writer.writerow({
-                        'timestamp': timestamp,
-                        'order_id': order_id,
-                        'issue_id': f"{order_id}-{i}",
-                        'issue_type': issue.get('issue_type', 'Unknown'),
-                        'location': issue.get('location', 'Unknown'),
-                        'severity': issue.get('severity', 'Unknown'),
-                        'description': issue.get('description', ''),
-                        'recommendation': issue.get('recommendation', '')
-                    })
+        with self.open_csv_sink(filename) as reporter:
+            reporter.append(order_id, analysis)
         
         print(f"Analysis saved to CSV: {filename}")
     
+    def open_csv_sink(self, filename: str) -> CsvReporter:
+        """
+        Open a CSV report that collects the analyses of many orders and writes them in one pass.
+        
+        Usage:
+            with analyzer.open_csv_sink("report.csv") as reporter:
+                reporter.append(order_id, analysis)
+        
+        Args:
+            filename: Path to the CSV file
+            
+        Returns:
+            CsvReporter to be used as a context manager
+        """
+        return CsvReporter(filename)
+    
     def generate_reference_data(self, output_file: str) -> None:
         """
         Generate sample reference data file.
@@ -1,9 +1,16 @@
 import json
 import os
 import argparse
-from typing import Dict, Any
+import logging
+from typing import Dict, Any, Tuple
 from dotenv import load_dotenv
-from bom_analyzer import BOMAnalyzer, generate_sample_orders
+from bom_analyzer import BOMAnalyzer, generate_sample_orders, loads_json
+
+# ijson is optional; it is only needed for --stream-items
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,8 +24,8 @@ def save_results(analysis: Dict[str, Any], filename: str) -> None:
 def load_order(filename: str) -> Dict[str, Any]:
     """Load order data from a JSON file."""
     try:
-        with open(filename, 'r') as f:
-            return json.load(f)
+        with open(filename, 'rb') as f:
+            return loads_json(f.read())
     except FileNotFoundError:
         print(f"File not found: {filename}")
         return None
@@ -26,6 +33,25 @@ def load_order(filename: str) -> Dict[str, Any]:
         print(f"Invalid JSON in file: {filename}")
         return None
 
+def stream_validate_order(analyzer: BOMAnalyzer, filename: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Run the local validators over an order file item by item, without loading it whole.
+    
+    Returns:
+        Tuple of (order ID, analysis results dictionary)
+    """
+    with open(filename, 'rb') as f:
+        order_id = next(ijson.items(f, 'order_id'), "unknown")
+    
+    with open(filename, 'rb') as f:
+        validation_issues = analyzer.validate_items_stream(ijson.items(f, 'items.item'))
+    
+    return order_id, {
+        "issues_found": bool(validation_issues),
+        "total_issues": len(validation_issues),
+        "analysis": validation_issues
+    }
+
 def main():
     parser = argparse.ArgumentParser(description='BOM Order Analyzer CLI')
     parser.add_argument('--input', '-i', help='Input JSON file containing order data')
@@ -42,9 +68,16 @@ def main():
     parser.add_argument('--reference-file', help='Path to reference data CSV file for item validation')
     parser.add_argument('--generate-reference', help='Generate sample reference data to specified file')
     parser.add_argument('--skip-local-validation', action='store_true', help='Skip local item validation (use only AI analysis)')
+    parser.add_argument('--always-llm', action='store_true', help='Run AI analysis even when local validation finds no issues')
+    parser.add_argument('--stream-items', action='store_true', help='Validate a large --input file item by item with local checks only (requires ijson)')
     
     args = parser.parse_args()
     
+    # Show the item validator's progress messages; other loggers stay at WARNING, so
+    # httpx does not log every API request over the output
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger("item_validator").setLevel(logging.INFO)
+    
     # Check for API key based on provider
     if args.provider == 'azure':
         api_key = os.environ.get("AZURE_OPENAI_API_KEY")
@@ -90,13 +123,15 @@ def main():
             azure_endpoint=args.azure_endpoint,
             azure_deployment=args.azure_deployment,
             azure_api_version=args.azure_api_version,
-            reference_file=args.reference_file
+            reference_file=args.reference_file,
+            always_llm=args.always_llm
         )
     else:
         analyzer = BOMAnalyzer(
             api_key=api_key, 
             model=args.model,
-            reference_file=args.reference_file
+            reference_file=args.reference_file,
+            always_llm=args.always_llm
         )
     
     # Generate reference data if requested
@@ -106,35 +141,48 @@ def main():
         if not args.input and not args.sample and not args.clean:
             return
     
-    # Determine the order data source
-    order_data = None
-    
-    if args.input:
-        print(f"Loading order data from {args.input}...")
-        order_data = load_order(args.input)
-        if not order_data:
+    if args.stream_items:
+        if not args.input:
+            print("--stream-items requires --input")
+            return
+        if ijson is None:
+            print("--stream-items requires the ijson package: pip install ijson")
             return
-    elif args.sample or args.clean or not args.input:
-        include_issues = not args.clean
-        status = "clean" if args.clean else "problematic"
-        print(f"Generating {status} sample BOM order data...")
-        order_data = generate_sample_orders(include_issues=include_issues)
         
-        if args.save_sample:
-            with open(args.save_sample, 'w') as f:
-                json.dump(order_data, f, indent=2)
-            print(f"Sample data saved to {args.save_sample}")
-    
-    # Display the order data
-    print("\n📋 BOM Order Data:")
-    print(json.dumps(order_data, indent=2))
-    
-    # Analyze the order
-    print("\n🔍 Analyzing BOM order data...")
-    analysis_results = analyzer.analyze_order(
-        order_data, 
-        use_local_validation=not args.skip_local_validation
-    )
+        print(f"\n🔍 Validating items of {args.input} as a stream (local checks only)...")
+        order_id, analysis_results = stream_validate_order(analyzer, args.input)
+    else:
+        # Determine the order data source
+        order_data = None
+        
+        if args.input:
+            print(f"Loading order data from {args.input}...")
+            order_data = load_order(args.input)
+            if not order_data:
+                return
+        elif args.sample or args.clean or not args.input:
+            include_issues = not args.clean
+            status = "clean" if args.clean else "problematic"
+            print(f"Generating {status} sample BOM order data...")
+            order_data = generate_sample_orders(include_issues=include_issues)
+        
+            if args.save_sample:
+                with open(args.save_sample, 'w') as f:
+                    json.dump(order_data, f, indent=2)
+                print(f"Sample data saved to {args.save_sample}")
+        
+        # Display the order data
+        print("\n📋 BOM Order Data:")
+        print(json.dumps(order_data, indent=2))
+        
+        # Analyze the order
+        print("\n🔍 Analyzing BOM order data...")
+        analysis_results = analyzer.analyze_order(
+            order_data, 
+            use_local_validation=not args.skip_local_validation
+        )
+        
+        order_id = order_data.get("order_id", "unknown")
     
     # Display the analysis report
     print("\n📊 Analysis Report:")
@@ -147,7 +195,6 @@ def main():
     
     # Save to CSV if requested
     if args.csv:
-        order_id = order_data.get("order_id", "unknown")
         analyzer.save_analysis_to_csv(order_id, analysis_results, args.csv)
 
 if __name__ == "__main__":
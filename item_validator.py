@@ -1,7 +1,82 @@
 import re
 import csv
+import difflib
+import functools
+import logging
 import os
-from typing import Dict, List, Optional, Tuple
+import pickle
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# re2 is optional; the item patterns need no backtracking, so its linear-time
+# engine can match them when it is installed
+try:
+    import re2 as regex_engine
+except ImportError:
+    regex_engine = re
+
+# rapidfuzz is optional; without it suggestions are ranked with difflib
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    process = None
+
+# pyarrow is optional; its multithreaded CSV reader parses large reference files much faster
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+# Reference data stored per item number
+RefItem = namedtuple("RefItem", ["description", "category"])
+
+# Bump when the pickled reference data changes shape, so older caches are reparsed
+REFERENCE_CACHE_VERSION = 3
+
+# Columns read from reference CSV files
+REFERENCE_COLUMNS = ("item_number", "description", "category")
+
+# Bytes of CSV that pyarrow parses per batch; quoted values may span blocks only
+# because the reader sets newlines_in_values
+REFERENCE_BLOCK_SIZE = 1 << 22
+
+# Sample reference data written by generate_reference_data, header first
+_SAMPLE_REFERENCE_DATA = (
+    ("item_number", "description", "category"),
+    ("PCB-X7700", "Main Circuit Board", "Electronics"),
+    ("CAP-3300-10V", "10V Capacitor", "Components"),
+    ("RES-2K-0.25W", "2K Ohm Resistor", "Components"),
+    ("IC-8085", "Microprocessor", "Electronics"),
+    ("CONN-DB9-F", "DB9 Female Connector", "Connectors"),
+    ("CONN-DB9-M", "DB9 Male Connector", "Connectors"),
+    ("DIODE-1N4001", "1A Diode", "Components"),
+    ("PCB-A1234", "Power Supply Board", "Electronics"),
+    ("CAP-2200-25V", "25V Capacitor", "Components"),
+    ("RES-10K-0.50W", "10K Ohm Resistor", "Components"),
+)
+
+# difflib is pure Python, so larger prefix groups fall back to their first item
+DIFFLIB_MAX_CANDIDATES = 2000
+
+def _prefix(item_number: str) -> str:
+    """Return the part of an item number before its first dash, or "" if it has none."""
+    head, dash, _ = item_number.partition('-')
+    return head if dash else ""
+
+def _closest_match(item_number: str, candidates: List[str]) -> Optional[str]:
+    """Return the candidate most similar to item_number, or None if none is at least 60% similar."""
+    if process is not None:
+        match = process.extractOne(item_number, candidates, scorer=fuzz.ratio, score_cutoff=60)
+        return match[0] if match else None
+    
+    if len(candidates) > DIFFLIB_MAX_CANDIDATES:
+        return None
+    
+    matches = difflib.get_close_matches(item_number, candidates, n=1, cutoff=0.6)
+    return matches[0] if matches else None
 
 class ItemValidator:
     """
@@ -14,16 +89,36 @@ class ItemValidator:
         Args:
             reference_file: Path to CSV file with reference data
         """
+        # item_number -> RefItem(description, category)
         self.reference_items = {}
+        # Reference item numbers grouped by prefix, for suggestions
+        self._ref_by_prefix = {}
+        # Compiled once so validation does not go through re's pattern cache per call
         self.item_patterns = {
-            "PCB": r"^PCB-[A-Z]\d{4}$",            # PCB-X7700
-            "CAP": r"^CAP-\d{4}-\d{1,3}V$",        # CAP-3300-10V
-            "RES": r"^RES-\d+[KM]?-\d+\.\d+W$",    # RES-2K-0.25W
-            "IC": r"^IC-\d{4}[A-Z]?$",             # IC-8085
-            "CONN": r"^CONN-[A-Z0-9]+-[MF]$",      # CONN-DB9-F
-            "DIODE": r"^DIODE-\d{1}N\d{4}$",       # DIODE-1N4001
+            prefix: regex_engine.compile(pattern)
+            for prefix, pattern in {
+                "PCB": r"^PCB-[A-Z]\d{4}$",            # PCB-X7700
+                "CAP": r"^CAP-\d{4}-\d{1,3}V$",        # CAP-3300-10V
+                "RES": r"^RES-\d+[KM]?-\d+\.\d+W$",    # RES-2K-0.25W
+                "IC": r"^IC-\d{4}[A-Z]?$",             # IC-8085
+                "CONN": r"^CONN-[A-Z0-9]+-[MF]$",      # CONN-DB9-F
+                "DIODE": r"^DIODE-\d{1}N\d{4}$",       # DIODE-1N4001
+            }.items()
         }
         
+        # All patterns fused into one alternation, so a single match both classifies
+        # the prefix (the named group that matched) and validates the format
+        self._combined_pattern = regex_engine.compile(
+            "^(?:" + "|".join(
+                f"(?P<{prefix}>{pattern.pattern[1:-1]})"
+                for prefix, pattern in self.item_patterns.items()
+            ) + ")$"
+        )
+        
+        # Results depend on the reference data, so the caches are cleared whenever it is loaded
+        self._validate_cached = functools.lru_cache(maxsize=4096)(self._validate_uncached)
+        self._suggest_cached = functools.lru_cache(maxsize=4096)(self._suggest_uncached)
+        
         if reference_file and os.path.exists(reference_file):
             self.load_reference_data(reference_file)
     
@@ -31,44 +126,186 @@ class ItemValidator:
         """
         Load reference data from a CSV file.
         
+        The parsed data is cached in a pickle next to the CSV (filename + ".pkl") and
+        reused for as long as the CSV's size and modification time are unchanged.
+        
         Expected CSV format:
         item_number,description,category
         """
         try:
-            with open(filename, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    self.reference_items[row['item_number']] = {
-                        'description': row['description'],
-                        'category': row['category']
-                    }
-            print(f"Loaded {len(self.reference_items)} reference items")
+            stat = os.stat(filename)
+            signature = (REFERENCE_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+            
+            cached = self._load_reference_cache(filename, signature)
+            if cached is None:
+                cached = self._parse_reference_csv(filename)
+                self._save_reference_cache(filename, signature, cached)
+            items, ref_by_prefix = cached
+            
+            if not self.reference_items:
+                self.reference_items, self._ref_by_prefix = items, ref_by_prefix
+            else:
+                # Merge into reference data loaded earlier
+                for item_number, reference in items.items():
+                    if item_number not in self.reference_items:
+                        prefix = _prefix(item_number)
+                        self._ref_by_prefix.setdefault(prefix, []).append(item_number)
+                    self.reference_items[item_number] = reference
+            self.cache_clear()
+            log.info("Loaded %d reference items", len(self.reference_items))
         except Exception as e:
-            print(f"Error loading reference data: {str(e)}")
+            log.error("Error loading reference data: %s", e)
+    
+    def _parse_reference_csv(self, filename: str) -> Tuple[Dict[str, RefItem], Dict[str, List[str]]]:
+        """
+        Parse a reference CSV.
+        
+        Returns:
+            Tuple of (item_number -> RefItem, prefix -> item numbers)
+        """
+        def collect(rows: Iterable[Tuple[str, str, str]]) -> Tuple[Dict[str, RefItem], Dict[str, List[str]]]:
+            items = {}
+            ref_by_prefix = {}
+            for item_number, description, category in rows:
+                if item_number not in items:
+                    prefix = _prefix(item_number)
+                    ref_by_prefix.setdefault(prefix, []).append(item_number)
+                items[item_number] = RefItem(description, category)
+            return items, ref_by_prefix
+        
+        if pacsv is not None:
+            try:
+                return collect(self._read_reference_rows(filename))
+            except pa.ArrowInvalid as e:
+                # pyarrow rejects rows with a different number of columns, which the
+                # csv module path fills in like DictReader did
+                log.debug("Rereading %s without pyarrow: %s", filename, e)
+        
+        return collect(self._read_reference_rows(filename, use_pyarrow=False))
+    
+    def _read_reference_rows(self, filename: str, use_pyarrow: bool = True) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yield (item_number, description, category) rows of a reference CSV, using
+        pyarrow's CSV reader when it is installed and use_pyarrow is set.
+        
+        Rows are read incrementally, so only the parsed reference data stays in memory,
+        not a copy of the whole file.
+        """
+        if use_pyarrow and pacsv is not None:
+            reader = pacsv.open_csv(
+                filename,
+                read_options=pacsv.ReadOptions(block_size=REFERENCE_BLOCK_SIZE),
+                # Quoted values may contain newlines, as the csv module allows
+                parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                convert_options=pacsv.ConvertOptions(
+                    include_columns=list(REFERENCE_COLUMNS),
+                    column_types={column: pa.string() for column in REFERENCE_COLUMNS}
+                )
+            )
+            for batch in reader:
+                columns = batch.to_pydict()
+                yield from zip(*(columns[column] for column in REFERENCE_COLUMNS))
+            return
+        
+        with open(filename, 'r') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            i_num, i_desc, i_cat = (header.index(column) for column in REFERENCE_COLUMNS)
+            width = len(header)
+            for row in reader:
+                # Like DictReader: skip blank lines and fill missing columns with None
+                if not row:
+                    continue
+                if len(row) < width:
+                    row += [None] * (width - len(row))
+                yield row[i_num], row[i_desc], row[i_cat]
+    
+    def _load_reference_cache(self, filename: str, signature: Tuple[int, int, int]) -> Optional[Tuple[Dict, Dict]]:
+        """
+        Return the cached parse of a reference CSV, or None if there is no up-to-date cache.
+        """
+        # Any unreadable cache, e.g. one written by another version, just means reparsing the CSV
+        try:
+            with open(filename + ".pkl", 'rb') as f:
+                cached_signature, (items, ref_by_prefix) = pickle.load(f)
+        except Exception:
+            return None
+        
+        if cached_signature != signature:
+            return None
+        return {item_number: RefItem._make(reference) for item_number, reference in items.items()}, ref_by_prefix
+    
+    def _save_reference_cache(self, filename: str, signature: Tuple[int, int, int], parsed: Tuple[Dict, Dict]) -> None:
+        """
+        Cache the parse of a reference CSV; failing to write the cache is not an error.
+        
+        References are pickled as plain tuples, since RefItems pickled by the
+        python item_validator.py demo would refer to __main__.RefItem.
+        """
+        items, ref_by_prefix = parsed
+        plain = {item_number: tuple(reference) for item_number, reference in items.items()}
+        cache_file = filename + ".pkl"
+        tmp_file = cache_file + ".tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((signature, (plain, ref_by_prefix)), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
     
     def validate_item_number(self, item_number: str) -> Tuple[bool, str]:
         """
         Validate an item number against patterns and reference data.
         
+        Results are memoized, since BOMs tend to repeat the same item numbers.
+        
         Returns:
             Tuple of (is_valid, error_message)
         """
+        return self._validate_cached(item_number)
+    
+    def cache_clear(self) -> None:
+        """
+        Forget memoized validation results and suggestions; call after changing
+        reference_items directly.
+        """
+        self._validate_cached.cache_clear()
+        self._suggest_cached.cache_clear()
+    
+    def _validate_uncached(self, item_number: str) -> Tuple[bool, str]:
+        """
+        Validate an item number without consulting the memoized results.
+        """
         # Check if it exists in reference data
         if item_number in self.reference_items:
             return True, ""
         
         # Check if it matches any pattern
-        prefix = item_number.split('-')[0] if '-' in item_number else ""
+        if self._combined_pattern.match(item_number):
+            return True, ""
+        
+        # Invalid item number: find the prefix only to explain what was expected
+        prefix = _prefix(item_number)
         
         if prefix in self.item_patterns:
             pattern = self.item_patterns[prefix]
-            if re.match(pattern, item_number):
-                return True, ""
-            else:
-                return False, f"Item number {item_number} does not match expected pattern {pattern}"
+            return False, f"Item number {item_number} does not match expected pattern {pattern.pattern}"
         
         return False, f"Unknown item number prefix: {prefix}"
     
+    def validate_many(self, item_numbers: Iterable[str]) -> List[bool]:
+        """
+        Check many item numbers at once, without building error messages.
+        
+        Use validate_item_number for the items that fail to find out why.
+        
+        Returns:
+            List of is_valid flags, in the same order as the input
+        """
+        reference_items = self.reference_items
+        match = self._combined_pattern.match
+        return [item_number in reference_items or match(item_number) is not None for item_number in item_numbers]
+    
     def suggest_correction(self, item_number: str) -> Optional[str]:
         """
         Suggest a correction for an invalid item number.
@@ -76,21 +313,25 @@ class ItemValidator:
         Returns:
             Suggested correct item number or None
         """
-        prefix = item_number.split('-')[0] if '-' in item_number else ""
+        return self._suggest_cached(item_number)
+    
+    def _suggest_uncached(self, item_number: str) -> Optional[str]:
+        """
+        Suggest a correction without consulting the memoized suggestions.
+        """
+        prefix = _prefix(item_number)
         
         # Simple correction for common prefixes
-        if prefix == "CONN" and not item_number.endswith("-M") and not item_number.endswith("-F"):
+        if prefix == "CONN" and not item_number.endswith(("-M", "-F")):
             # Missing gender indicator
             return f"{item_number}-F"
         
-        # Check reference data for similar items
-        similar_items = []
-        for ref_item in self.reference_items:
-            if prefix in ref_item:
-                similar_items.append(ref_item)
+        # Check reference data for items with the same prefix
+        similar_items = self._ref_by_prefix.get(prefix)
         
         if similar_items:
-            return similar_items[0]  # Return first similar item
+            # Prefer the most similar reference item, else the first one
+            return _closest_match(item_number, similar_items) or similar_items[0]
         
         return None
     
@@ -98,29 +339,17 @@ class ItemValidator:
         """
         Generate sample reference data file.
         """
-        reference_data = [
-            ["item_number", "description", "category"],
-            ["PCB-X7700", "Main Circuit Board", "Electronics"],
-            ["CAP-3300-10V", "10V Capacitor", "Components"],
-            ["RES-2K-0.25W", "2K Ohm Resistor", "Components"],
-            ["IC-8085", "Microprocessor", "Electronics"],
-            ["CONN-DB9-F", "DB9 Female Connector", "Connectors"],
-            ["CONN-DB9-M", "DB9 Male Connector", "Connectors"],
-            ["DIODE-1N4001", "1A Diode", "Components"],
-            ["PCB-A1234", "Power Supply Board", "Electronics"],
-            ["CAP-2200-25V", "25V Capacitor", "Components"],
-            ["RES-10K-0.50W", "10K Ohm Resistor", "Components"]
-        ]
-        
         try:
-            with open(output_file, 'w', newline='') as f:
+            with open(output_file, 'w', newline='', buffering=1 << 20) as f:
                 writer = csv.writer(f)
-                writer.writerows(reference_data)
-            print(f"Generated reference data saved to {output_file}")
+                writer.writerows(_SAMPLE_REFERENCE_DATA)
+            log.info("Generated reference data saved to %s", output_file)
         except Exception as e:
-            print(f"Error generating reference data: {str(e)}")
+            log.error("Error generating reference data: %s", e)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
     # Example usage
     validator = ItemValidator()
     